@@ -3,9 +3,12 @@ models.py (14-12-20)
 https://github.com/knazeri/edge-informed-sisr/blob/1b4a6e897a84545fdecdd7acdb5273147b9321cb/src/models.py
 """
 
+import inspect
+import warnings
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import torch.utils.checkpoint as checkpoint
 import numpy as np
 
 
@@ -21,10 +24,7 @@ class BaseNetwork(nn.Module):
         """
 
         def init_func(m):
-            classname = m.__class__.__name__
-            if hasattr(m, "weight") and (
-                classname.find("Conv") != -1 or classname.find("Linear") != -1
-            ):
+            if isinstance(m, (nn.Conv2d, nn.ConvTranspose2d, nn.Linear)):
                 if init_type == "normal":
                     nn.init.normal_(m.weight.data, 0.0, gain)
                 elif init_type == "xavier":
@@ -37,142 +37,334 @@ class BaseNetwork(nn.Module):
                 if hasattr(m, "bias") and m.bias is not None:
                     nn.init.constant_(m.bias.data, 0.0)
 
-            elif classname.find("BatchNorm2d") != -1:
+            elif isinstance(m, nn.BatchNorm2d):
                 nn.init.normal_(m.weight.data, 1.0, gain)
                 nn.init.constant_(m.bias.data, 0.0)
 
-        self.apply(init_func)
+        with torch.no_grad():
+            self.apply(init_func)
+
+
+class FastIN(nn.Module):
+    """
+    InstanceNorm2d without affine / running stats, written out elementwise so
+    the reduction can fuse with what follows and channels_last is kept
+    (CUDA group_norm / instance_norm make the input NCHW contiguous)
+    """
+
+    def forward(self, x):
+        # stats in fp32, the reduction over H*W is too long for fp16
+        var, mean = torch.var_mean(x.float(), dim=(2, 3), unbiased=False, keepdim=True)
+        return ((x - mean) * torch.rsqrt(var + 1e-5)).to(x.dtype)
+
+
+def reflect_pad(x, pad_h, pad_w):
+    # flip + cat keep the memory format, F.pad(mode="reflect") returns NCHW on CUDA
+    if pad_w:
+        left = x[..., 1 : pad_w + 1].flip(-1)
+        right = x[..., -pad_w - 1 : -1].flip(-1)
+        x = torch.cat((left, x, right), dim=-1)
+    if pad_h:
+        top = x[..., 1 : pad_h + 1, :].flip(-2)
+        bottom = x[..., -pad_h - 1 : -1, :].flip(-2)
+        x = torch.cat((top, x, bottom), dim=-2)
+
+    return x
+
+
+class ReflectConv2d(nn.Conv2d):
+    """
+    Conv2d(padding_mode="reflect") padding through reflect_pad, same parameters
+    and state_dict keys as nn.Conv2d
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, padding_mode="reflect", **kwargs)
+
+    def _conv_forward(self, input, weight, bias):
+        return F.conv2d(
+            reflect_pad(input, *self.padding),
+            weight,
+            bias,
+            self.stride,
+            0,
+            self.dilation,
+            self.groups,
+        )
+
+
+class PixelShuffle(nn.Module):
+    """
+    nn.PixelShuffle that keeps channels_last, the stock CUDA op falls back to
+    a NCHW copy which the next conv has to transpose back
+    """
+
+    def __init__(self, upscale_factor):
+        super().__init__()
+        self.upscale_factor = upscale_factor
+
+    def forward(self, x):
+        n, c, h, w = x.shape
+        r = self.upscale_factor
+        # shuffle on the NHWC view, one copy, then view back as NCHW
+        x = x.permute(0, 2, 3, 1).reshape(n, h, w, c // (r * r), r, r)
+        x = x.permute(0, 1, 4, 2, 5, 3).reshape(n, h * r, w * r, c // (r * r))
+        return x.permute(0, 3, 1, 2)
 
 
 class SRGenerator(BaseNetwork):
-    def __init__(self, scale=4, residual_blocks=8, init_weights=True):
+    def __init__(
+        self,
+        scale=4,
+        residual_blocks=8,
+        init_weights=True,
+        use_compile=False,
+        fast_encoder=False,
+        use_checkpoint=True,
+    ):
         super().__init__()
 
+        if fast_encoder:
+            # one stride 4 conv, skips the 128 channel stage (needs retraining)
+            downsample = [
+                nn.Conv2d(
+                    in_channels=64, out_channels=256, kernel_size=8, stride=4, padding=2
+                ),
+                FastIN(),
+                nn.ReLU(True),
+            ]
+        else:
+            downsample = [
+                nn.Conv2d(
+                    in_channels=64, out_channels=128, kernel_size=4, stride=2, padding=1
+                ),
+                FastIN(),
+                nn.ReLU(True),
+                nn.Conv2d(
+                    in_channels=128,
+                    out_channels=256,
+                    kernel_size=4,
+                    stride=2,
+                    padding=1,
+                ),
+                FastIN(),
+                nn.ReLU(True),
+            ]
+
         self.encoder = nn.Sequential(
-            nn.ReflectionPad2d(3),
-            nn.Conv2d(in_channels=4, out_channels=64, kernel_size=7, padding=0),
-            nn.InstanceNorm2d(64, track_running_stats=False),
-            nn.ReLU(True),
-            nn.Conv2d(
-                in_channels=64, out_channels=128, kernel_size=4, stride=2, padding=1
-            ),
-            nn.InstanceNorm2d(128, track_running_stats=False),
-            nn.ReLU(True),
-            nn.Conv2d(
-                in_channels=128, out_channels=256, kernel_size=4, stride=2, padding=1
+            ReflectConv2d(
+                in_channels=4,
+                out_channels=64,
+                kernel_size=7,
+                padding=3,
             ),
-            nn.InstanceNorm2d(256, track_running_stats=False),
+            FastIN(),
             nn.ReLU(True),
+            *downsample,
         )
 
-        blocks = []
-        for _ in range(residual_blocks):
-            block = ResnetBlock(256, 2)
-            blocks.append(block)
-
-        self.middle = nn.Sequential(*blocks)
+        self.middle = nn.Sequential(
+            *[ResnetBlock(256, 2) for _ in range(residual_blocks)]
+        )
 
         self.decoder = nn.Sequential(
-            nn.ConvTranspose2d(
-                in_channels=256, out_channels=128, kernel_size=4, stride=2, padding=1
+            nn.Sequential(
+                nn.Conv2d(
+                    in_channels=256, out_channels=128 * 4, kernel_size=3, padding=1
+                ),
+                PixelShuffle(2),
             ),
-            nn.InstanceNorm2d(128, track_running_stats=False),
+            FastIN(),
             nn.ReLU(True),
-            nn.ConvTranspose2d(
-                in_channels=128, out_channels=64, kernel_size=4, stride=2, padding=1
+            nn.Sequential(
+                nn.Conv2d(
+                    in_channels=128, out_channels=64 * 4, kernel_size=3, padding=1
+                ),
+                PixelShuffle(2),
             ),
-            nn.InstanceNorm2d(64, track_running_stats=False),
+            FastIN(),
             nn.ReLU(True),
-            nn.ReflectionPad2d(3),
-            nn.Conv2d(in_channels=64, out_channels=3, kernel_size=7, padding=0),
+            ReflectConv2d(
+                in_channels=64,
+                out_channels=3,
+                kernel_size=7,
+                padding=3,
+            ),
         )
 
         if init_weights:
             self.init_weights()
 
+        # run the conv stack in NHWC so cuDNN can pick its channels_last kernels
+        self.to(memory_format=torch.channels_last)
+
+        self.use_compile = use_compile
+        self.use_checkpoint = use_checkpoint
+        # let inductor fuse the InstanceNorm + ReLU epilogues, convs stay on cuDNN
+        # blocks are compiled one by one, checkpoint_sequential calls them directly
+        compile_module(self.encoder, use_compile)
+        for block in self.middle:
+            compile_module(block, use_compile)
+        compile_module(self.decoder, use_compile)
+
     def forward(self, x):
         x = self.encoder(x)
-        x = self.middle(x)
+        if self.training and self.use_checkpoint and len(self.middle) > 0:
+            # recompute the resnet blocks in backward instead of keeping activations
+            x = checkpoint_sequential(self.middle, x)
+        else:
+            x = self.middle(x)
         x = self.decoder(x)
-        x = (torch.tanh(x) + 1) / 2
+        if torch.is_grad_enabled() or self.use_compile:
+            # tanh saves its output for backward, and a compiled decoder may
+            # return CUDA graph memory, so no in-place ops here
+            x = (torch.tanh(x) + 1) / 2
+        else:
+            x = x.tanh_().add_(1.0).mul_(0.5)
 
         return x
 
 
 class EdgeGenerator(BaseNetwork):
     def __init__(
-        self, scale=4, residual_blocks=8, use_spectral_norm=True, init_weights=True
+        self,
+        scale=4,
+        residual_blocks=8,
+        use_spectral_norm=True,
+        init_weights=True,
+        use_compile=False,
+        fast_encoder=False,
+        use_checkpoint=True,
     ):
         super().__init__()
 
-        self.encoder = nn.Sequential(
-            nn.ReflectionPad2d(3),
-            spectral_norm(
-                nn.Conv2d(in_channels=4, out_channels=64, kernel_size=7, padding=0),
-                use_spectral_norm,
-            ),
-            nn.InstanceNorm2d(64, track_running_stats=False),
-            nn.ReLU(True),
-            spectral_norm(
-                nn.Conv2d(
-                    in_channels=64, out_channels=128, kernel_size=4, stride=2, padding=1
+        if fast_encoder:
+            # one stride 4 conv, skips the 128 channel stage (needs retraining)
+            downsample = [
+                spectral_norm(
+                    nn.Conv2d(
+                        in_channels=64,
+                        out_channels=256,
+                        kernel_size=8,
+                        stride=4,
+                        padding=2,
+                    ),
+                    use_spectral_norm,
                 ),
-                use_spectral_norm,
-            ),
-            nn.InstanceNorm2d(128, track_running_stats=False),
-            nn.ReLU(True),
+                FastIN(),
+                nn.ReLU(True),
+            ]
+        else:
+            downsample = [
+                spectral_norm(
+                    nn.Conv2d(
+                        in_channels=64,
+                        out_channels=128,
+                        kernel_size=4,
+                        stride=2,
+                        padding=1,
+                    ),
+                    use_spectral_norm,
+                ),
+                FastIN(),
+                nn.ReLU(True),
+                spectral_norm(
+                    nn.Conv2d(
+                        in_channels=128,
+                        out_channels=256,
+                        kernel_size=4,
+                        stride=2,
+                        padding=1,
+                    ),
+                    use_spectral_norm,
+                ),
+                FastIN(),
+                nn.ReLU(True),
+            ]
+
+        self.encoder = nn.Sequential(
             spectral_norm(
-                nn.Conv2d(
-                    in_channels=128,
-                    out_channels=256,
-                    kernel_size=4,
-                    stride=2,
-                    padding=1,
+                ReflectConv2d(
+                    in_channels=4,
+                    out_channels=64,
+                    kernel_size=7,
+                    padding=3,
                 ),
                 use_spectral_norm,
             ),
-            nn.InstanceNorm2d(256, track_running_stats=False),
+            FastIN(),
             nn.ReLU(True),
+            *downsample,
         )
 
-        blocks = []
-        for _ in range(residual_blocks):
-            block = ResnetBlock(256, 2, use_spectral_norm=use_spectral_norm)
-            blocks.append(block)
-
-        self.middle = nn.Sequential(*blocks)
+        self.middle = nn.Sequential(
+            *[
+                ResnetBlock(256, 2, use_spectral_norm=use_spectral_norm)
+                for _ in range(residual_blocks)
+            ]
+        )
 
         self.decoder = nn.Sequential(
-            spectral_norm(
-                nn.ConvTranspose2d(
-                    in_channels=256,
-                    out_channels=128,
-                    kernel_size=4,
-                    stride=2,
-                    padding=1,
+            nn.Sequential(
+                spectral_norm(
+                    nn.Conv2d(
+                        in_channels=256,
+                        out_channels=128 * 4,
+                        kernel_size=3,
+                        padding=1,
+                    ),
+                    use_spectral_norm,
                 ),
-                use_spectral_norm,
+                PixelShuffle(2),
             ),
-            nn.InstanceNorm2d(128, track_running_stats=False),
+            FastIN(),
             nn.ReLU(True),
-            spectral_norm(
-                nn.ConvTranspose2d(
-                    in_channels=128, out_channels=64, kernel_size=4, stride=2, padding=1
+            nn.Sequential(
+                spectral_norm(
+                    nn.Conv2d(
+                        in_channels=128,
+                        out_channels=64 * 4,
+                        kernel_size=3,
+                        padding=1,
+                    ),
+                    use_spectral_norm,
                 ),
-                use_spectral_norm,
+                PixelShuffle(2),
             ),
-            nn.InstanceNorm2d(64, track_running_stats=False),
+            FastIN(),
             nn.ReLU(True),
-            nn.ReflectionPad2d(3),
-            nn.Conv2d(in_channels=64, out_channels=1, kernel_size=7, padding=0),
+            ReflectConv2d(
+                in_channels=64,
+                out_channels=1,
+                kernel_size=7,
+                padding=3,
+            ),
         )
 
         if init_weights:
             self.init_weights()
 
+        # run the conv stack in NHWC so cuDNN can pick its channels_last kernels
+        self.to(memory_format=torch.channels_last)
+
+        # the spectral norm pre-hook runs a power iteration and updates u / v in
+        # place, a checkpoint recompute would run it twice and backprop through
+        # a different W / sigma than the forward used
+        self.use_checkpoint = use_checkpoint and not use_spectral_norm
+        # let inductor fuse the InstanceNorm + ReLU epilogues, convs stay on cuDNN
+        # blocks are compiled one by one, checkpoint_sequential calls them directly
+        compile_module(self.encoder, use_compile)
+        for block in self.middle:
+            compile_module(block, use_compile)
+        compile_module(self.decoder, use_compile)
+
     def forward(self, x):
         x = self.encoder(x)
-        x = self.middle(x)
+        if self.training and self.use_checkpoint and len(self.middle) > 0:
+            # recompute the resnet blocks in backward instead of keeping activations
+            x = checkpoint_sequential(self.middle, x)
+        else:
+            x = self.middle(x)
         x = self.decoder(x)
         x = torch.sigmoid(x)
         return x
@@ -181,38 +373,38 @@ class EdgeGenerator(BaseNetwork):
 class ResnetBlock(nn.Module):
     def __init__(self, dim, dilation=1, use_spectral_norm=False):
         super(ResnetBlock, self).__init__()
-        self.conv_block = nn.Sequential(
-            nn.ReflectionPad2d(dilation),
+        bias = not use_spectral_norm
+        self.body = nn.Sequential(
             spectral_norm(
-                nn.Conv2d(
+                ReflectConv2d(
                     in_channels=dim,
                     out_channels=dim,
                     kernel_size=3,
-                    padding=0,
+                    padding=dilation,
                     dilation=dilation,
-                    bias=not use_spectral_norm,
+                    bias=bias,
                 ),
                 use_spectral_norm,
             ),
-            nn.InstanceNorm2d(dim, track_running_stats=False),
+            FastIN(),
             nn.ReLU(True),
-            nn.ReflectionPad2d(1),
             spectral_norm(
-                nn.Conv2d(
+                ReflectConv2d(
                     in_channels=dim,
                     out_channels=dim,
                     kernel_size=3,
-                    padding=0,
+                    padding=1,
                     dilation=1,
-                    bias=not use_spectral_norm,
+                    bias=bias,
                 ),
                 use_spectral_norm,
             ),
-            nn.InstanceNorm2d(dim, track_running_stats=False),
         )
+        # kept out of body so the last norm and the residual add fuse
+        self.norm = FastIN()
 
     def forward(self, x):
-        out = x + self.conv_block(x)
+        out = x + self.norm(self.body(x))
 
         # Remove ReLU at the end of the residual block
         # http://torch.ch/blog/2016/02/04/resnets.html
@@ -227,7 +419,37 @@ def spectral_norm(module, mode=True):
     return module
 
 
+def checkpoint_sequential(blocks, x, segments=4):
+    kwargs = {}
+    # use_reentrant is only accepted from torch 1.13 on
+    params = inspect.signature(checkpoint.checkpoint_sequential).parameters
+    if "use_reentrant" in params:
+        kwargs["use_reentrant"] = False
+
+    return checkpoint.checkpoint_sequential(
+        blocks, min(segments, len(blocks)), x, **kwargs
+    )
+
+
+def compile_module(module, mode=True):
+    # compiles in place (torch>=2.2), keeping state_dict keys unchanged
+    if not mode:
+        return module
+
+    if hasattr(module, "compile"):
+        module.compile(mode="reduce-overhead", fullgraph=False)
+    else:
+        warnings.warn(
+            f"use_compile needs nn.Module.compile (torch>=2.2), torch "
+            f"{torch.__version__} runs {module.__class__.__name__} in eager mode"
+        )
+
+    return module
+
+
+import copy
 import os
+import subprocess
 import torch
 import torch.nn as nn
 import torch.optim as optim
@@ -236,36 +458,285 @@ from torchvision.utils import save_image
 import torch.nn.functional as F
 
 
+def require_torch(feature, version=(2, 0)):
+    # single minimum for the inference helpers (onnx opset 17, fx quantization
+    # with the x86 backend), training itself still runs on older torch
+    current = tuple(int(v) for v in torch.__version__.split("+")[0].split(".")[:2])
+    if current < version:
+        raise RuntimeError(
+            f"{feature} needs torch>={'.'.join(map(str, version))}, "
+            f"found {torch.__version__}"
+        )
+
+
 class EdgeSRModel(nn.Module):
-    def __init__(self, use_spectral_norm=True):
+    def __init__(
+        self,
+        use_spectral_norm=True,
+        use_compile=False,
+        fast_encoder=False,
+        use_autocast=False,
+    ):
         super().__init__()
-        self.EdgeGenerator = EdgeGenerator(use_spectral_norm=use_spectral_norm)
-        self.SRGenerator = SRGenerator()
+        # fp16 autocast inside forward, for inference only, training precision
+        # is controlled by the trainer's use_amp
+        self.use_autocast = use_autocast
+        self.EdgeGenerator = EdgeGenerator(
+            use_spectral_norm=use_spectral_norm,
+            use_compile=use_compile,
+            fast_encoder=fast_encoder,
+        )
+        self.SRGenerator = SRGenerator(
+            use_compile=use_compile, fast_encoder=fast_encoder
+        )
+        self._graph = None
+
+    def freeze_for_inference(self):
+        """
+        absorb the spectral norm of the EdgeGenerator into its conv weights,
+        call once after loading the checkpoint and before the first inference
+        modifies self in place, use frozen_copy to keep the trainable model
+        """
+        self.eval()
+        # tracing / export have to go through the network, not a graph replay
+        self._graph = None
+        for m in self.EdgeGenerator.modules():
+            if hasattr(m, "weight_orig"):
+                nn.utils.remove_spectral_norm(m)
+
+        return self
+
+    def frozen_copy(self):
+        """
+        inference copy with spectral norm absorbed, self is left untouched
+        """
+        # a captured CUDA graph can't be copied and isn't needed in the copy
+        return copy.deepcopy(self, {id(self._graph): None}).freeze_for_inference()
+
+    def export_trt(self, sample_lr, sample_edges, path):
+        """
+        inference only: export to onnx with fixed shapes and build a fp16
+        TensorRT engine next to it with trtexec (needs TensorRT installed)
+        build the model with use_compile=False, compiled modules don't trace
+        """
+        require_torch("export_trt")
+        model = self.frozen_copy()
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (sample_lr, sample_edges),
+                path,
+                opset_version=17,
+                dynamic_axes=None,
+                do_constant_folding=True,
+            )
+
+        engine_path = path + ".trt"
+        subprocess.run(
+            ["trtexec", f"--onnx={path}", "--fp16", f"--saveEngine={engine_path}"],
+            check=True,
+        )
+        return engine_path
+
+    def to_inference(self, sample_lr, sample_edges):
+        """
+        frozen TorchScript module with conv folding / fusion applied
+        benchmark from the third call on, the profiling executor needs warmup
+        build the model with use_compile=False, compiled modules don't trace
+        turns on cudnn.benchmark (process-wide) for the fixed inference shape
+        """
+        require_torch("to_inference")
+        torch.backends.cudnn.benchmark = True
+        model = self.frozen_copy()
+        with torch.no_grad():
+            traced = torch.jit.trace(model, (sample_lr, sample_edges))
+            frozen = torch.jit.freeze(traced)
+            optimized = torch.jit.optimize_for_inference(frozen)
+
+        return optimized
+
+    def capture(self, sample_lr, sample_edges):
+        """
+        record the inference forward into a CUDA graph, later no_grad calls
+        with the same shapes replay it instead of launching every kernel
+        build the model with use_compile=False, reduce-overhead already uses graphs
+        turns on cudnn.benchmark (process-wide), the warmup picks the algorithms
+        """
+        require_torch("capture")
+        torch.backends.cudnn.benchmark = True
+        self.eval()
+        self._graph = None
+        self._static_lr = sample_lr.clone()
+        self._static_edges = sample_edges.clone()
+
+        # streams and the capture have to live on the model's device
+        with torch.cuda.device(sample_lr.device):
+            # warmup on a side stream, also lets cudnn.benchmark settle
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.no_grad(), torch.cuda.stream(stream):
+                for _ in range(3):
+                    self(self._static_lr, self._static_edges)
+            torch.cuda.current_stream().wait_stream(stream)
+
+            graph = torch.cuda.CUDAGraph()
+            with torch.no_grad(), torch.cuda.graph(graph):
+                self._static_out = self(self._static_lr, self._static_edges)
+        self._graph = graph
+
+        return self
+
+    def _apply(self, fn, *args, **kwargs):
+        # .to() / .cuda() / .half() may reallocate the parameters the graph
+        # reads, replaying it afterwards would use freed memory
+        self._graph = None
+        return super()._apply(fn, *args, **kwargs)
+
+    def _can_replay(self, lr, lr_edges):
+        # copy_ would broadcast, so only replay for the exact captured inputs
+        if self._graph is None or self.training or torch.is_grad_enabled():
+            return False
+
+        return all(
+            x.shape == static.shape
+            and x.dtype == static.dtype
+            and x.device == static.device
+            for x, static in (
+                (lr, self._static_lr),
+                (lr_edges, self._static_edges),
+            )
+        )
 
     def forward(self, lr, lr_edges):
-        # edge
-        # inputting rgb data
-        lr_scaled = F.interpolate(
-            lr, scale_factor=4
-        )  # NN upscaling rgb LR to match HR size
-
-        # inputting bw data (does not work)
-        # lr_scaled = F.interpolate(lr_gray, scale_factor=4) # NN upscaling gray "rgb" LR to match HR size
-
-        # scaling and concentrating data
-        lr_edges_scaled = F.interpolate(
-            lr_edges, scale_factor=4
-        )  # NN upscaling lr canny to match HR size
-        inputs = torch.cat((lr_scaled, lr_edges_scaled), dim=1)
-
-        edge_gen = self.EdgeGenerator(
-            inputs
-        )  # in: [rgb(3) + edge(1)] / out: edge(1) (estimaged edges for HR image)
-
-        # inpaint
-        inputs = torch.cat((lr_scaled, edge_gen), dim=1)
-
-        outputs = self.SRGenerator(
-            inputs
-        )  # in: [rgb(3) + output(1)] / out: rgb(3) (SR image)
-        return outputs
+        if self._can_replay(lr, lr_edges):
+            self._static_lr.copy_(lr)
+            self._static_edges.copy_(lr_edges)
+            self._graph.replay()
+            return self._static_out.clone()
+
+        c = lr.shape[1]
+
+        # fp16 conv stack on Tensor Cores, master weights stay fp32
+        with torch.autocast(
+            device_type="cuda",
+            dtype=torch.float16,
+            enabled=self.use_autocast and lr.is_cuda,
+        ):
+            # edge
+            # inputting rgb data
+            # inputting bw data (does not work)
+            # lr_scaled = F.interpolate(lr_gray, scale_factor=4) # NN upscaling gray "rgb" LR to match HR size
+
+            # concentrating at LR size, then a single NN upscaling of rgb + lr canny
+            # to match HR size, instead of two upscales and a cat of HR tensors
+            # converted to channels_last here, on the small LR tensor
+            lr_input = torch.cat((lr, lr_edges), dim=1).contiguous(
+                memory_format=torch.channels_last
+            )
+            inputs = F.interpolate(lr_input, scale_factor=4, mode="nearest")
+
+            edge_gen = self.EdgeGenerator(
+                inputs
+            )  # in: [rgb(3) + edge(1)] / out: edge(1) (estimaged edges for HR image)
+
+            # inpaint
+            if torch.is_grad_enabled():
+                # the first conv saved inputs for backward, so it can't be overwritten
+                inputs = torch.cat((inputs[:, :c], edge_gen), dim=1)
+            else:
+                inputs[:, c:].copy_(edge_gen)
+
+            outputs = self.SRGenerator(
+                inputs
+            )  # in: [rgb(3) + output(1)] / out: rgb(3) (SR image)
+
+        return outputs.to(lr.dtype)
+
+
+class EdgeSRModelInt8(nn.Module):
+    """
+    int8 post-training quantized EdgeSRModel for CPU inference (fx graph mode)
+    model: EdgeSRModel with loaded weights, preferably built with use_compile=False
+    calib_data: iterable of (lr, lr_edges) batches, ~32 is enough
+    the passed model is left untouched, but torch.backends.quantized.engine is
+    set to backend process-wide since the converted modules run on that engine
+    """
+
+    def __init__(self, model, calib_data, backend="x86"):
+        super().__init__()
+        require_torch("EdgeSRModelInt8")
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+        torch.backends.quantized.engine = backend
+        qconfig_mapping = get_default_qconfig_mapping(backend)
+
+        model = model.frozen_copy().cpu()
+        calib_data = [(lr.cpu(), lr_edges.cpu()) for lr, lr_edges in calib_data]
+        lr, lr_edges = calib_data[0]
+        c = lr.shape[1]
+
+        with torch.no_grad():
+            inputs = self.upscale(lr, lr_edges)
+            edge_inputs = (inputs,)
+            sr_inputs = (
+                torch.cat((inputs[:, :c], model.EdgeGenerator(inputs)), dim=1),
+            )
+
+        # quantized InstanceNorm support is weak, use the GroupNorm equivalent
+        swap_instance_norm(model.EdgeGenerator, edge_inputs)
+        swap_instance_norm(model.SRGenerator, sr_inputs)
+        # fx quantization only matches plain nn.Conv2d
+        for m in model.modules():
+            if isinstance(m, ReflectConv2d):
+                m.__class__ = nn.Conv2d
+
+        edge_gen = prepare_fx(model.EdgeGenerator, qconfig_mapping, edge_inputs)
+        sr_gen = prepare_fx(model.SRGenerator, qconfig_mapping, sr_inputs)
+
+        with torch.no_grad():
+            for lr, lr_edges in calib_data:
+                inputs = self.upscale(lr, lr_edges)
+                sr_gen(torch.cat((inputs[:, :c], edge_gen(inputs)), dim=1))
+
+        self.EdgeGenerator = convert_fx(edge_gen)
+        self.SRGenerator = convert_fx(sr_gen)
+
+    @staticmethod
+    def upscale(lr, lr_edges):
+        lr_input = torch.cat((lr, lr_edges), dim=1).contiguous(
+            memory_format=torch.channels_last
+        )
+        return F.interpolate(lr_input, scale_factor=4, mode="nearest")
+
+    def forward(self, lr, lr_edges):
+        inputs = self.upscale(lr, lr_edges)
+        edge_gen = self.EdgeGenerator(inputs)
+        inputs = torch.cat((inputs[:, : lr.shape[1]], edge_gen), dim=1)
+        return self.SRGenerator(inputs)
+
+
+def swap_instance_norm(module, example_inputs):
+    """
+    replace every FastIN in module with nn.GroupNorm(C, C), reading C from
+    a forward pass over example_inputs
+    """
+    channels = {}
+    hooks = [
+        m.register_forward_pre_hook(
+            lambda m, inputs: channels.__setitem__(m, inputs[0].shape[1])
+        )
+        for m in module.modules()
+        if isinstance(m, FastIN)
+    ]
+    with torch.no_grad():
+        module(*example_inputs)
+    for hook in hooks:
+        hook.remove()
+
+    for parent in list(module.modules()):
+        for name, child in list(parent.named_children()):
+            if child in channels:
+                setattr(parent, name, nn.GroupNorm(channels[child], channels[child]))
+
+    return module
@@ -0,0 +1,105 @@
+import copy
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from arch.sisr_arch import (  # noqa: E402
+    EdgeGenerator,
+    EdgeSRModel,
+    FastIN,
+    PixelShuffle,
+    ReflectConv2d,
+    SRGenerator,
+)
+
+
+def backward_grads(model, x):
+    model.train()
+    model(x).mean().backward()
+    return {name: p.grad for name, p in model.named_parameters()}
+
+
+def assert_same_training_step(model, ref, x):
+    grads = backward_grads(model, x)
+    ref_grads = backward_grads(ref, x)
+    for name, grad in grads.items():
+        assert torch.allclose(grad, ref_grads[name], atol=1e-6), name
+
+    # spectral norm u / v buffers must see exactly one power iteration
+    for (name, buf), ref_buf in zip(model.named_buffers(), ref.buffers()):
+        assert torch.equal(buf, ref_buf), name
+
+
+def test_edge_generator_spectral_norm_checkpoint_grads():
+    torch.manual_seed(0)
+    model = EdgeGenerator(residual_blocks=2, use_spectral_norm=True)
+    ref = copy.deepcopy(model)
+    ref.use_checkpoint = False
+
+    assert_same_training_step(model, ref, torch.rand(2, 4, 32, 32))
+
+
+def test_sr_generator_checkpoint_grads():
+    torch.manual_seed(0)
+    model = SRGenerator(residual_blocks=2)
+    assert model.use_checkpoint
+    ref = copy.deepcopy(model)
+    ref.use_checkpoint = False
+
+    assert_same_training_step(model, ref, torch.rand(2, 4, 32, 32))
+
+
+def test_pixel_shuffle_matches_torch_and_keeps_channels_last():
+    x = torch.rand(2, 16, 5, 7).contiguous(memory_format=torch.channels_last)
+    out = PixelShuffle(2)(x)
+
+    assert torch.equal(out, torch.nn.functional.pixel_shuffle(x, 2))
+    assert out.is_contiguous(memory_format=torch.channels_last)
+
+
+def test_fast_in_matches_instance_norm():
+    x = torch.rand(2, 8, 9, 11)
+    expected = torch.nn.functional.instance_norm(x)
+
+    assert torch.allclose(FastIN()(x), expected, atol=1e-5)
+
+
+def test_reflect_conv_matches_conv2d():
+    torch.manual_seed(0)
+    conv = torch.nn.Conv2d(8, 8, 3, padding=2, dilation=2, padding_mode="reflect")
+    reflect_conv = ReflectConv2d(8, 8, 3, padding=2, dilation=2)
+    reflect_conv.load_state_dict(conv.state_dict())
+    x = torch.rand(2, 8, 9, 11)
+
+    assert torch.allclose(reflect_conv(x), conv(x), atol=1e-6)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="needs CUDA")
+@pytest.mark.parametrize("grad", [False, True])
+def test_channels_last_holds_through_generators(grad):
+    model = EdgeSRModel(use_spectral_norm=True).cuda()
+    model.train(grad)
+    lr = torch.rand(2, 3, 16, 16, device="cuda")
+    lr_edges = torch.rand(2, 1, 16, 16, device="cuda")
+
+    # every module boundary has to stay NHWC, a NCHW output means a transpose
+    nchw = []
+
+    def check(module, inputs, output):
+        if not output.is_contiguous(memory_format=torch.channels_last):
+            nchw.append(module.__class__.__name__)
+
+    for m in model.modules():
+        if m is not model:
+            m.register_forward_hook(check)
+
+    with torch.set_grad_enabled(grad):
+        model(lr, lr_edges)
+
+    assert not nchw